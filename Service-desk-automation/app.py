@@ -1,28 +1,59 @@
 from flask import Flask, render_template, jsonify, request, redirect, url_for
-from email_processor import parse_email_line, classify_issue
+from email_processor import parse_email_line, classify_issue_id
 from auto_resolver import resolve_status
 import database
+import atexit
+import logging
+import logging.handlers
 import os
-import hashlib
+import queue
+import threading
+from itertools import islice
 import config
+from dedup import is_processed, mark_processed_many, reset_processed, migrate_legacy_file
 
 # Import new automation modules
 from graph_client import fetch_o365_emails, graph_client
 from notifications import notifier
 from scheduler import automation_scheduler
-from sla_tracker import run_sla_check, get_sla_summary, check_sla_status
+from sla_tracker import run_sla_check, get_sla_summary, check_sla_status, compute_sla_bulk
 from assignment import assign_ticket, process_assignment
+from jobs import job_queue
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 EMAILS_FILE = os.path.join(DATA_DIR, 'emails.txt')
-PROCESSED_FILE = os.path.join(DATA_DIR, 'processed_emails.txt')
+LEGACY_PROCESSED_FILE = os.path.join(DATA_DIR, 'processed_emails.txt')
+# Emails stored per transaction; matches the Graph page size
+INGEST_CHUNK_SIZE = 50
+
+def setup_logging():
+    """
+    Route all log records through a queue; a listener thread does the console I/O,
+    so scheduler and worker threads never block on stdout.
+    """
+    records = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+    listener = logging.handlers.QueueListener(records, console, respect_handler_level=True)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(config.LOG_LEVEL)
+    listener.start()
+    atexit.register(listener.stop)
 
 
-def email_hash(text: str) -> str:
-    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+# Only one ingestion batch may run at a time (scheduler and /process share it)
+_process_lock = threading.Lock()
+
+
+@app.teardown_appcontext
+def rollback_db(exc):
+    """Don't leave a failed request's transaction open on the pooled connection."""
+    if exc is not None:
+        database.rollback()
 
 
 @app.route('/')
@@ -34,10 +65,7 @@ def dashboard():
 
 @app.route('/tickets')
 def tickets():
-    tickets = database.list_tickets()
-    # Add SLA status to each ticket
-    for t in tickets:
-        t['sla'] = check_sla_status(t)
+    tickets = compute_sla_bulk(database.list_tickets())
     return render_template('tickets.html', tickets=tickets)
 
 
@@ -48,102 +76,119 @@ def analytics():
     return render_template('analytics.html', dist=dist, sla=sla_summary)
 
 
-@app.route('/process')
-def process_emails():
+def process_email_batch() -> dict:
     """
     Process emails from file (demo mode) or O365 Graph API.
-    Creates tickets with auto-assignment and notifications.
+    Creates tickets; assignment notifications are dispatched as separate jobs.
+    Runs on a background worker, never on the request thread.
     """
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(PROCESSED_FILE):
-        open(PROCESSED_FILE, 'w', encoding='utf-8').close()
+    if not _process_lock.acquire(blocking=False):
+        return {'processed': 'skipped', 'created': 0, 'message': 'Processing already in progress'}
+    try:
+        return _process_email_batch()
+    finally:
+        _process_lock.release()
 
-    processed_hashes = set(line.strip() for line in open(PROCESSED_FILE, encoding='utf-8') if line.strip())
-    created = []
-    source = 'file'
+
+def _process_email_batch() -> dict:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    migrate_legacy_file(LEGACY_PROCESSED_FILE, EMAILS_FILE)
 
     # Try O365 Graph API if configured and not in demo mode
     if graph_client.is_configured() and not config.DEMO_MODE:
         source = 'o365'
-        emails = fetch_o365_emails()
-        for email in emails:
-            msg_id = email.get('id', '')
-            h = email_hash(msg_id)
-            if h in processed_hashes:
-                continue
-
-            summary = (email.get('subject', '') + '\n' + email.get('body', '')).lower()
-            category, priority = classify_issue(summary)
-            assigned_to = config.TEAM_ASSIGNMENTS.get(category, '')
-
-            ticket_id = database.create_ticket(
-                sender=email.get('sender', 'unknown'),
-                issue=email.get('subject', '(no subject)'),
-                category=category,
-                priority=priority,
-                status='New',
-                assigned_to=assigned_to,
-                message_id=msg_id
-            )
-
-            new_status = resolve_status(priority)
-            database.update_ticket_status(ticket_id, new_status)
-
-            # Process assignment and send notifications
-            ticket = database.get_ticket_by_id(ticket_id)
-            if ticket:
-                process_assignment(ticket)
-
-            created.append({'id': ticket_id, 'status': new_status, 'category': category})
-
-            # Mark email as processed
-            with open(PROCESSED_FILE, 'a', encoding='utf-8') as pf:
-                pf.write(h + '\n')
-
-            # Mark as read in O365
-            graph_client.mark_as_read(msg_id)
-
+        pending = _pending_o365_emails()
     else:
         # File-based processing (demo mode)
+        source = 'file'
         if not os.path.exists(EMAILS_FILE):
-            return jsonify({'processed': 0, 'created': 0, 'message': 'No emails.txt found', 'source': source}), 200
+            return {'processed': 0, 'created': 0, 'message': 'No emails.txt found', 'source': source}
+        pending = _pending_file_emails()
 
-        for raw in open(EMAILS_FILE, encoding='utf-8'):
+    # Each chunk is stored, marked processed and marked read before the next
+    # one is fetched, so a large backlog is never held in memory at once
+    created = []
+    while True:
+        chunk = list(islice(pending, INGEST_CHUNK_SIZE))
+        if not chunk:
+            break
+        created.extend(_ingest_chunk(chunk, source))
+
+    return {'processed': 'complete', 'created': len(created), 'source': source, 'tickets': created}
+
+
+def _pending_o365_emails():
+    """(message id, email) for unread O365 emails not processed before."""
+    seen = set()
+    for email in fetch_o365_emails():
+        msg_id = email.get('id', '')
+        if msg_id in seen or is_processed(msg_id):
+            continue
+        seen.add(msg_id)
+        yield msg_id, email
+
+
+def _pending_file_emails():
+    """(raw line, email) for lines of emails.txt not processed before."""
+    seen = set()
+    with open(EMAILS_FILE, encoding='utf-8') as f:
+        for raw in f:
             raw = raw.strip()
-            if not raw:
-                continue
-            h = email_hash(raw)
-            if h in processed_hashes:
+            if not raw or raw in seen or is_processed(raw):
                 continue
+            seen.add(raw)
+            yield raw, parse_email_line(raw)
+
+
+def _ingest_chunk(pending, source: str) -> list:
+    # Classify and route in plain Python, then insert the whole chunk at once
+    rows = []
+    for key, email in pending:
+        category_id, priority = classify_issue_id(email.get('subject', '') + '\n' + email.get('body', ''))
+        rows.append({
+            'sender': email.get('sender', 'unknown'),
+            'issue': email.get('subject', '(no subject)'),
+            'category': config.CATEGORIES[category_id],
+            'category_id': category_id,
+            'priority': priority,
+            'status': resolve_status(priority),
+            'assigned_to': config.TEAM_BY_IDX[category_id],
+            'message_id': key if source == 'o365' else ''
+        })
+    tickets = database.create_tickets_bulk(rows)
+
+    created = []
+    for ticket in tickets:
+        # Process assignment and send notifications
+        job_queue.spawn(process_assignment, ticket)
+        created.append({'id': ticket['id'], 'status': ticket['status'], 'category': ticket['category']})
 
-            email = parse_email_line(raw)
-            summary = (email.get('subject', '') + '\n' + email.get('body', '')).lower()
-            category, priority = classify_issue(summary)
-            assigned_to = config.TEAM_ASSIGNMENTS.get(category, '')
+    # Mark emails as processed
+    mark_processed_many([key for key, _ in pending])
 
-            ticket_id = database.create_ticket(
-                sender=email.get('sender', 'unknown'),
-                issue=email.get('subject', '(no subject)'),
-                category=category,
-                priority=priority,
-                status='New',
-                assigned_to=assigned_to
-            )
+    # Mark as read in O365, batched into as few Graph calls as possible.
+    # Later pages shift as these drop out of the unread filter; anything
+    # skipped that way is picked up by the next poll.
+    if source == 'o365':
+        graph_client.mark_many_as_read([key for key, _ in pending])
 
-            new_status = resolve_status(priority)
-            database.update_ticket_status(ticket_id, new_status)
+    return created
 
-            # Process assignment and send notifications
-            ticket = database.get_ticket_by_id(ticket_id)
-            if ticket:
-                process_assignment(ticket)
 
-            created.append({'id': ticket_id, 'status': new_status, 'category': category})
+@app.route('/process')
+def process_emails():
+    """Queue an email processing batch and return its job id immediately."""
+    job_id = job_queue.submit(process_email_batch)
+    return jsonify({'job_id': job_id, 'status_url': url_for('api_job_status', job_id=job_id)}), 202
 
-            with open(PROCESSED_FILE, 'a', encoding='utf-8') as pf:
-                pf.write(h + '\n')
 
-    return jsonify({'processed': 'complete', 'created': len(created), 'source': source, 'tickets': created})
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """Get status and result of a background job."""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 
 # ============ NEW API ROUTES ============
@@ -177,22 +222,27 @@ def api_sla_check():
 @app.route('/api/tickets')
 def api_tickets():
     """Get all tickets as JSON."""
-    tickets = database.list_tickets()
+    tickets = compute_sla_bulk(database.list_tickets())
     for t in tickets:
-        t['sla'] = {
-            'response_ok': check_sla_status(t)['response_ok'],
-            'resolution_ok': check_sla_status(t)['resolution_ok'],
-            'breached': check_sla_status(t)['breached']
-        }
+        t['sla'] = _sla_json(t['sla'])
     return jsonify(tickets)
 
 
+def _sla_json(sla: dict) -> dict:
+    """JSON-safe subset of an SLA status (time_to_breach is a timedelta)."""
+    return {
+        'response_ok': sla['response_ok'],
+        'resolution_ok': sla['resolution_ok'],
+        'breached': sla['breached']
+    }
+
+
 @app.route('/api/ticket/<int:ticket_id>')
 def api_ticket_detail(ticket_id):
     """Get single ticket details."""
     ticket = database.get_ticket_by_id(ticket_id)
     if ticket:
-        ticket['sla'] = check_sla_status(ticket)
+        ticket['sla'] = _sla_json(check_sla_status(ticket))
         return jsonify(ticket)
     return jsonify({'error': 'Ticket not found'}), 404
 
@@ -200,12 +250,10 @@ def api_ticket_detail(ticket_id):
 @app.route('/api/ticket/<int:ticket_id>/resolve', methods=['GET', 'POST'])
 def api_resolve_ticket(ticket_id):
     """Manually resolve a ticket."""
-    ticket = database.get_ticket_by_id(ticket_id)
+    ticket = database.update_ticket_status_returning(ticket_id, 'Closed')
     if not ticket:
         return jsonify({'error': 'Ticket not found'}), 404
     
-    database.update_ticket_status(ticket_id, 'Closed')
-    ticket['status'] = 'Closed'
     notifier.send_ticket_resolved(ticket)
     
     # If GET request (from browser link), redirect back to tickets page
@@ -217,16 +265,11 @@ def api_resolve_ticket(ticket_id):
 @app.route('/api/ticket/<int:ticket_id>/escalate', methods=['GET', 'POST'])
 def api_escalate_ticket(ticket_id):
     """Escalate a ticket to high priority."""
-    ticket = database.get_ticket_by_id(ticket_id)
+    ticket = database.update_ticket_returning(ticket_id, status='Escalated', priority='High')
     if not ticket:
         return jsonify({'error': 'Ticket not found'}), 404
     
-    database.update_ticket_status(ticket_id, 'Escalated')
-    database.update_ticket_priority(ticket_id, 'High')
-    ticket['status'] = 'Escalated'
-    ticket['priority'] = 'High'
-    
-    team_email = config.TEAM_ASSIGNMENTS.get(ticket['category'], 'helpdesk@example.com')
+    team_email = config.TEAM_BY_IDX[ticket['category_id']]
     notifier.send_ticket_escalated(ticket, team_email)
     
     if request.method == 'GET':
@@ -237,12 +280,10 @@ def api_escalate_ticket(ticket_id):
 @app.route('/api/ticket/<int:ticket_id>/reopen', methods=['GET', 'POST'])
 def api_reopen_ticket(ticket_id):
     """Reopen a closed ticket."""
-    ticket = database.get_ticket_by_id(ticket_id)
+    ticket = database.update_ticket_status_returning(ticket_id, 'Open')
     if not ticket:
         return jsonify({'error': 'Ticket not found'}), 404
     
-    database.update_ticket_status(ticket_id, 'Open')
-    
     if request.method == 'GET':
         return redirect(url_for('tickets'))
     return jsonify({'success': True, 'ticket_id': ticket_id, 'status': 'Open'})
@@ -251,17 +292,15 @@ def api_reopen_ticket(ticket_id):
 @app.route('/api/ticket/<int:ticket_id>/assign', methods=['POST'])
 def api_assign_ticket(ticket_id):
     """Assign ticket to a team/person."""
-    ticket = database.get_ticket_by_id(ticket_id)
-    if not ticket:
-        return jsonify({'error': 'Ticket not found'}), 404
-    
     data = request.get_json() or {}
     assigned_to = data.get('assigned_to', '')
+    if not assigned_to:
+        return jsonify({'error': 'assigned_to required'}), 400
     
-    if assigned_to:
-        database.update_ticket_assignment(ticket_id, assigned_to)
-        return jsonify({'success': True, 'ticket_id': ticket_id, 'assigned_to': assigned_to})
-    return jsonify({'error': 'assigned_to required'}), 400
+    ticket = database.update_ticket_assignment_returning(ticket_id, assigned_to)
+    if not ticket:
+        return jsonify({'error': 'Ticket not found'}), 404
+    return jsonify({'success': True, 'ticket_id': ticket_id, 'assigned_to': assigned_to})
 
 
 @app.route('/api/tickets/filter')
@@ -271,17 +310,10 @@ def api_tickets_filter():
     priority = request.args.get('priority', '')
     category = request.args.get('category', '')
     
-    tickets = database.list_tickets()
+    tickets = database.find_tickets(status=status, priority=priority, category=category)
     
-    if status:
-        tickets = [t for t in tickets if t['status'].lower() == status.lower()]
-    if priority:
-        tickets = [t for t in tickets if t['priority'].lower() == priority.lower()]
-    if category:
-        tickets = [t for t in tickets if t['category'].lower() == category.lower()]
-    
-    for t in tickets:
-        t['sla'] = check_sla_status(t)
+    for t in compute_sla_bulk(tickets):
+        t['sla'] = _sla_json(t['sla'])
     
     return jsonify({'count': len(tickets), 'tickets': tickets})
 
@@ -293,8 +325,7 @@ def api_tickets_search():
     if not q:
         return jsonify({'error': 'Query parameter q required'}), 400
     
-    tickets = database.list_tickets()
-    results = [t for t in tickets if q in t['issue'].lower() or q in t['sender'].lower()]
+    results = database.find_tickets(q=q)
     
     return jsonify({'query': q, 'count': len(results), 'tickets': results})
 
@@ -357,7 +388,7 @@ def api_teams():
 def api_reset_processed():
     """Clear processed emails list to reprocess all emails."""
     try:
-        open(PROCESSED_FILE, 'w', encoding='utf-8').close()
+        reset_processed()
         return jsonify({'success': True, 'message': 'Processed emails list cleared'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -413,7 +444,8 @@ def new_ticket_page():
 
 
 if __name__ == '__main__':
+    setup_logging()
     database.init_db()
     # Start background scheduler for automatic processing
-    automation_scheduler.start(process_func=process_emails, sla_check_func=run_sla_check)
+    automation_scheduler.start(process_func=process_email_batch, sla_check_func=run_sla_check)
     app.run(debug=True, port=5000)
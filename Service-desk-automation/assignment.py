@@ -43,16 +43,5 @@ def process_assignment(ticket: dict) -> dict:
 def get_team_workload() -> dict:
     """Get count of open tickets per team (for load balancing)."""
     import database
-    tickets = database.list_tickets()
-    
-    workload = {}
-    for team in config.TEAM_ASSIGNMENTS.values():
-        workload[team] = 0
-    
-    for ticket in tickets:
-        if ticket.get('status') not in ('Closed', 'Resolved'):
-            assigned = ticket.get('assigned_to', '')
-            if assigned in workload:
-                workload[assigned] += 1
-    
-    return workload
+    open_counts = database.get_open_workload_by_assignee()
+    return {team: open_counts.get(team, 0) for team in config.TEAM_ASSIGNMENTS.values()}
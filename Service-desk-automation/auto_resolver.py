@@ -1,11 +1,12 @@
 """Simple auto-resolution engine for tickets based on priority."""
 
+# Lowercased priority -> status assigned on ticket creation
+STATUS_MAP = {
+    'low': 'Closed',
+    'medium': 'Open',
+    'high': 'Escalated',
+}
+
+
 def resolve_status(priority: str) -> str:
-    p = (priority or '').lower()
-    if p == 'low':
-        return 'Closed'
-    if p == 'medium':
-        return 'Open'
-    if p == 'high':
-        return 'Escalated'
-    return 'Open'
+    return STATUS_MAP.get((priority or '').lower(), 'Open')
@@ -17,10 +17,14 @@ SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
 SMTP_USERNAME = os.getenv('SMTP_USERNAME', '')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
 NOTIFICATION_FROM = os.getenv('NOTIFICATION_FROM', 'servicedesk@example.com')
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '3'))  # concurrent SMTP connections
 
 # ============ Automation Settings ============
 POLL_INTERVAL_SECONDS = int(os.getenv('POLL_INTERVAL', '60'))  # how often to check emails
 AUTO_PROCESS_ENABLED = os.getenv('AUTO_PROCESS', 'false').lower() == 'true'
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # background worker threads
+JOBS_EAGER = os.getenv('JOBS_EAGER', 'false').lower() == 'true'  # run jobs inline (debugging)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()  # DEBUG shows per-ticket/per-email lines
 
 # ============ SLA Settings (in hours) ============
 SLA_RESPONSE_HOURS = {
@@ -44,6 +48,13 @@ TEAM_ASSIGNMENTS = {
     'General': 'helpdesk@example.com'
 }
 
+# Fixed category order; hot paths index these tuples by category id
+# instead of hashing category names.
+CATEGORIES = ('Access Issue', 'Infrastructure', 'Email', 'Software', 'Networking', 'General')
+CATEGORY_IDX = {name: i for i, name in enumerate(CATEGORIES)}
+GENERAL_CATEGORY_ID = CATEGORY_IDX['General']
+TEAM_BY_IDX = tuple(TEAM_ASSIGNMENTS.get(name, TEAM_ASSIGNMENTS['General']) for name in CATEGORIES)
+
 # ============ Demo Mode ============
 # When True, uses file-based email input instead of Graph API
 DEMO_MODE = os.getenv('DEMO_MODE', 'true').lower() == 'true'
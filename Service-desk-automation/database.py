@@ -1,21 +1,73 @@
 """SQLite helpers for tickets."""
 import sqlite3
 import os
+import threading
 import datetime
+import time
+import config
+import sla_rules
 
 BASE_DIR = os.path.dirname(__file__)
 DB_PATH = os.path.join(BASE_DIR, 'service_desk.db')
+TICKET_COLUMNS = ('id', 'sender', 'issue', 'category', 'priority', 'status', 'assigned_to',
+                  'message_id', 'created_at', 'updated_at', 'resolution_due', 'category_id')
+
+
+_local = threading.local()
+
+# Dashboard aggregates are cached briefly; writes that change them invalidate
+STATS_TTL_SECONDS = 5
+_stats_cache = {}
 
 
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """
+    Return this thread's connection, opening it on first use.
+    Writes run inside `with conn:` so a failed statement is rolled back
+    rather than left open for the thread's next commit.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=-64000')
+        conn.create_function('sla_resolution_due', 2, resolution_due_for, deterministic=True)
+        # SQLite's lower()/LIKE only fold ASCII; this matches Python's str.lower()
+        conn.create_function('py_lower', 1, _py_lower, deterministic=True)
+        _local.conn = conn
     return conn
 
 
+def _py_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def resolution_due_for(priority, created_at):
+    """ISO timestamp (UTC) by which a ticket of this priority must be resolved."""
+    created = sla_rules.iso_to_epoch(created_at)
+    if created is None:
+        return None
+    return sla_rules.epoch_to_iso(sla_rules.resolution_due_epoch(priority, created))
+
+
+def category_id_for(category):
+    """Index into config.CATEGORIES; unknown categories count as General."""
+    return config.CATEGORY_IDX.get(category, config.GENERAL_CATEGORY_ID)
+
+
+def rollback():
+    """Discard any transaction left open on this thread's connection."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
 def init_db():
     conn = get_conn()
     cur = conn.cursor()
+    # WAL lets readers run alongside the writer and makes commits cheaper
+    cur.execute('PRAGMA journal_mode=WAL')
     cur.execute('''
     CREATE TABLE IF NOT EXISTS tickets (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -27,7 +79,9 @@ def init_db():
         assigned_to TEXT,
         message_id TEXT,
         created_at TEXT,
-        updated_at TEXT
+        updated_at TEXT,
+        resolution_due TEXT,
+        category_id INTEGER
     )
     ''')
     # Migration: add new columns if they don't exist
@@ -43,30 +97,110 @@ def init_db():
         cur.execute('ALTER TABLE tickets ADD COLUMN updated_at TEXT')
     except:
         pass
+    try:
+        cur.execute('ALTER TABLE tickets ADD COLUMN resolution_due TEXT')
+    except sqlite3.OperationalError:
+        pass
+    cur.execute('UPDATE tickets SET resolution_due = sla_resolution_due(priority, created_at) '
+                'WHERE resolution_due IS NULL')
+    try:
+        cur.execute('ALTER TABLE tickets ADD COLUMN category_id INTEGER')
+    except sqlite3.OperationalError:
+        pass
+    cur.executemany('UPDATE tickets SET category_id = ? WHERE category_id IS NULL AND category = ?',
+                    [(idx, name) for name, idx in config.CATEGORY_IDX.items()])
+    cur.execute('UPDATE tickets SET category_id = ? WHERE category_id IS NULL', (config.GENERAL_CATEGORY_ID,))
+    cur.execute('CREATE TABLE IF NOT EXISTS processed (message_id TEXT PRIMARY KEY)')
+    cur.execute('CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)')
+    cur.execute('CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY, applied_at TEXT)')
+    # Case-insensitive indexes for the filter endpoint
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_status ON tickets(status COLLATE NOCASE)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_priority ON tickets(priority COLLATE NOCASE)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_category ON tickets(category COLLATE NOCASE)')
+    # ISO-8601 text sorts chronologically, so these serve ORDER BY and range scans
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON tickets(created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_updated_at ON tickets(updated_at)')
+    # Only open tickets can breach, so the SLA index skips closed ones
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_open_resolution_due ON tickets(resolution_due) "
+                "WHERE status NOT IN ('Closed', 'Resolved')")
+    _init_fts(cur)
     conn.commit()
-    conn.close()
+
+
+def _init_fts(cur):
+    """
+    Full-text index over issue/sender, kept in sync by triggers.
+    The trigram tokenizer gives case-insensitive substring matching.
+    Skipped if this SQLite build lacks FTS5; search then falls back to LIKE.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'tickets_fts'")
+    if cur.fetchone():
+        return
+    try:
+        cur.execute('''CREATE VIRTUAL TABLE tickets_fts USING fts5(
+                           issue, sender, content='tickets', content_rowid='id', tokenize='trigram')''')
+    except sqlite3.OperationalError:
+        return
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS tickets_fts_ai AFTER INSERT ON tickets BEGIN
+                       INSERT INTO tickets_fts(rowid, issue, sender) VALUES (new.id, new.issue, new.sender);
+                   END''')
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS tickets_fts_ad AFTER DELETE ON tickets BEGIN
+                       INSERT INTO tickets_fts(tickets_fts, rowid, issue, sender) VALUES ('delete', old.id, old.issue, old.sender);
+                   END''')
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS tickets_fts_au AFTER UPDATE OF issue, sender ON tickets BEGIN
+                       INSERT INTO tickets_fts(tickets_fts, rowid, issue, sender) VALUES ('delete', old.id, old.issue, old.sender);
+                       INSERT INTO tickets_fts(rowid, issue, sender) VALUES (new.id, new.issue, new.sender);
+                   END''')
+    # Index tickets that existed before the FTS table
+    cur.execute("INSERT INTO tickets_fts(tickets_fts) VALUES ('rebuild')")
 
 
 def create_ticket(sender, issue, category, priority, status='New', assigned_to='', message_id=''):
     conn = get_conn()
-    cur = conn.cursor()
-    created_at = datetime.datetime.utcnow().isoformat()
-    cur.execute('''INSERT INTO tickets (sender, issue, category, priority, status, assigned_to, message_id, created_at, updated_at)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-                (sender, issue, category, priority, status, assigned_to, message_id, created_at, created_at))
-    conn.commit()
+    with conn:
+        cur = conn.cursor()
+        created_at = datetime.datetime.utcnow().isoformat()
+        cur.execute('''INSERT INTO tickets (sender, issue, category, priority, status, assigned_to, message_id, created_at, updated_at, resolution_due, category_id)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
+                    (sender, issue, category, priority, status, assigned_to, message_id, created_at, created_at,
+                     resolution_due_for(priority, created_at), category_id_for(category)))
+    _invalidate_stats()
     ticket_id = cur.lastrowid
-    conn.close()
     return ticket_id
 
 
+def create_tickets_bulk(tickets):
+    """
+    Insert many tickets in a single transaction.
+    Each item is a dict with create_ticket's fields; returns the stored
+    tickets (with id and timestamps) in the same order.
+    """
+    if not tickets:
+        return []
+    conn = get_conn()
+    with conn:
+        cur = conn.cursor()
+        created_at = datetime.datetime.utcnow().isoformat()
+        rows = [(t['sender'], t['issue'], t['category'], t['priority'], t.get('status', 'New'),
+                 t.get('assigned_to', ''), t.get('message_id', ''), created_at, created_at,
+                 resolution_due_for(t['priority'], created_at), t.get('category_id', category_id_for(t['category'])))
+                for t in tickets]
+        cur.executemany('''INSERT INTO tickets (sender, issue, category, priority, status, assigned_to, message_id, created_at, updated_at, resolution_due, category_id)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        # The transaction holds the write lock, so the new ids are contiguous
+        cur.execute('SELECT last_insert_rowid()')
+        last_id = cur.fetchone()[0]
+    _invalidate_stats()
+    first_id = last_id - len(rows) + 1
+    return [dict(zip(TICKET_COLUMNS, (first_id + i,) + row)) for i, row in enumerate(rows)]
+
+
 def update_ticket_assignment(ticket_id, assigned_to):
     conn = get_conn()
-    cur = conn.cursor()
-    updated_at = datetime.datetime.utcnow().isoformat()
-    cur.execute('UPDATE tickets SET assigned_to = ?, updated_at = ? WHERE id = ?', (assigned_to, updated_at, ticket_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        cur = conn.cursor()
+        updated_at = datetime.datetime.utcnow().isoformat()
+        cur.execute('UPDATE tickets SET assigned_to = ?, updated_at = ? WHERE id = ?', (assigned_to, updated_at, ticket_id))
 
 
 def get_ticket_by_id(ticket_id):
@@ -74,26 +208,65 @@ def get_ticket_by_id(ticket_id):
     cur = conn.cursor()
     cur.execute('SELECT * FROM tickets WHERE id = ?', (ticket_id,))
     row = cur.fetchone()
-    conn.close()
     return dict(row) if row else None
 
 
 def update_ticket_status(ticket_id, status):
     conn = get_conn()
-    cur = conn.cursor()
-    updated_at = datetime.datetime.utcnow().isoformat()
-    cur.execute('UPDATE tickets SET status = ?, updated_at = ? WHERE id = ?', (status, updated_at, ticket_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        cur = conn.cursor()
+        updated_at = datetime.datetime.utcnow().isoformat()
+        cur.execute('UPDATE tickets SET status = ?, updated_at = ? WHERE id = ?', (status, updated_at, ticket_id))
+    _invalidate_stats()
 
 
 def update_ticket_priority(ticket_id, priority):
     conn = get_conn()
-    cur = conn.cursor()
-    updated_at = datetime.datetime.utcnow().isoformat()
-    cur.execute('UPDATE tickets SET priority = ?, updated_at = ? WHERE id = ?', (priority, updated_at, ticket_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        cur = conn.cursor()
+        updated_at = datetime.datetime.utcnow().isoformat()
+        cur.execute('UPDATE tickets SET priority = ?, resolution_due = sla_resolution_due(?, created_at), updated_at = ? '
+                    'WHERE id = ?', (priority, priority, updated_at, ticket_id))
+    _invalidate_stats()
+
+
+def update_ticket_returning(ticket_id, **fields):
+    """
+    Update the given columns (plus updated_at) and return the updated ticket,
+    or None if it doesn't exist, in a single UPDATE ... RETURNING statement.
+    """
+    for column in fields:
+        if column not in TICKET_COLUMNS or column in ('id', 'updated_at', 'resolution_due', 'category_id'):
+            raise ValueError(f'Cannot update column {column!r}')
+    if 'category' in fields:
+        fields['category_id'] = category_id_for(fields['category'])
+    fields['updated_at'] = datetime.datetime.utcnow().isoformat()
+    assignments = ', '.join(f'{column} = ?' for column in fields)
+    params = list(fields.values())
+    if 'priority' in fields:
+        # SET expressions see the old row, so pass the new priority explicitly
+        assignments += ', resolution_due = sla_resolution_due(?, created_at)'
+        params.append(fields['priority'])
+    conn = get_conn()
+    with conn:
+        cur = conn.cursor()
+        cur.execute(f'UPDATE tickets SET {assignments} WHERE id = ? RETURNING *', (*params, ticket_id))
+        row = cur.fetchone()
+    if 'status' in fields or 'priority' in fields:
+        _invalidate_stats()
+    return dict(row) if row else None
+
+
+def update_ticket_status_returning(ticket_id, status):
+    return update_ticket_returning(ticket_id, status=status)
+
+
+def update_ticket_priority_returning(ticket_id, priority):
+    return update_ticket_returning(ticket_id, priority=priority)
+
+
+def update_ticket_assignment_returning(ticket_id, assigned_to):
+    return update_ticket_returning(ticket_id, assigned_to=assigned_to)
 
 
 def list_tickets():
@@ -101,11 +274,120 @@ def list_tickets():
     cur = conn.cursor()
     cur.execute('SELECT * FROM tickets ORDER BY created_at DESC')
     rows = cur.fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 
+def list_open_tickets():
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM tickets WHERE status NOT IN ('Closed', 'Resolved')")
+    return [dict(r) for r in cur.fetchall()]
+
+
+def get_next_resolution_due(after):
+    """Earliest resolution_due of an open ticket strictly after the given ISO timestamp, or None."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(resolution_due) FROM tickets WHERE status NOT IN ('Closed', 'Resolved') "
+                "AND resolution_due > ?", (after,))
+    return cur.fetchone()[0]
+
+
+def count_sla_states(now, at_risk_before):
+    """
+    (total, breached, at_risk) ticket counts in one scan. Open tickets whose
+    resolution_due has passed are breached; those due before at_risk_before are at risk.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""SELECT COUNT(*),
+                          COALESCE(SUM(is_open AND resolution_due <= :now), 0),
+                          COALESCE(SUM(is_open AND resolution_due > :now AND resolution_due < :at_risk), 0)
+                   FROM (SELECT status NOT IN ('Closed', 'Resolved') AS is_open, resolution_due FROM tickets)""",
+                {'now': now, 'at_risk': at_risk_before})
+    return tuple(cur.fetchone())
+
+
+def list_tickets_updated_since(since):
+    """Tickets created or changed at or after the given ISO timestamp."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute('SELECT * FROM tickets WHERE updated_at >= ?', (since,))
+    return [dict(r) for r in cur.fetchall()]
+
+
+def find_tickets(status=None, priority=None, category=None, q=None):
+    """
+    Filter tickets in SQL. status/priority/category match case-insensitively;
+    q is a case-insensitive substring of issue or sender.
+    """
+    sql = 'SELECT * FROM tickets WHERE 1=1'
+    params = []
+    if status:
+        sql += ' AND status = ? COLLATE NOCASE'
+        params.append(status)
+    if priority:
+        sql += ' AND priority = ? COLLATE NOCASE'
+        params.append(priority)
+    if category:
+        sql += ' AND category = ? COLLATE NOCASE'
+        params.append(category)
+    if q:
+        # Trigrams need at least 3 characters; shorter queries scan with Python-style case folding
+        if len(q) >= 3 and _has_fts():
+            sql += ' AND id IN (SELECT rowid FROM tickets_fts WHERE tickets_fts MATCH ?)'
+            params.append('"' + q.replace('"', '""') + '"')
+        else:
+            sql += ' AND (instr(py_lower(issue), ?) > 0 OR instr(py_lower(sender), ?) > 0)'
+            params.extend([q.lower(), q.lower()])
+    sql += ' ORDER BY created_at DESC'
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    return [dict(r) for r in cur.fetchall()]
+
+
+_fts_available = None
+
+
+def _has_fts():
+    global _fts_available
+    if _fts_available is None:
+        cur = get_conn().cursor()
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'tickets_fts'")
+        _fts_available = cur.fetchone() is not None
+    return _fts_available
+
+
+def get_open_workload_by_assignee():
+    """Count of tickets not yet closed/resolved, keyed by assigned_to."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT assigned_to, COUNT(*) FROM tickets "
+                "WHERE status NOT IN ('Closed', 'Resolved') "
+                "GROUP BY assigned_to")
+    return {r[0]: r[1] for r in cur.fetchall()}
+
+
+def _cached(name, compute):
+    now = time.monotonic()
+    entry = _stats_cache.get(name)
+    if entry and now - entry[0] < STATS_TTL_SECONDS:
+        return entry[1]
+    value = compute()
+    _stats_cache[name] = (now, value)
+    return value
+
+
+def _invalidate_stats():
+    _stats_cache.clear()
+
+
 def get_stats():
+    return _cached('stats', _query_stats)
+
+
+def _query_stats():
     conn = get_conn()
     cur = conn.cursor()
     cur.execute('SELECT COUNT(*) FROM tickets')
@@ -114,16 +396,78 @@ def get_stats():
     open_tickets = cur.fetchone()[0]
     cur.execute("SELECT COUNT(*) FROM tickets WHERE status='Closed'")
     closed = cur.fetchone()[0]
-    conn.close()
     return {'total': total, 'open': open_tickets, 'resolved': closed}
 
 
 def get_distributions():
+    return _cached('distributions', _query_distributions)
+
+
+def _query_distributions():
     conn = get_conn()
     cur = conn.cursor()
     cur.execute('SELECT priority, COUNT(*) as cnt FROM tickets GROUP BY priority')
     pri = {r[0]: r[1] for r in cur.fetchall()}
     cur.execute('SELECT category, COUNT(*) as cnt FROM tickets GROUP BY category')
     cat = {r[0]: r[1] for r in cur.fetchall()}
-    conn.close()
     return {'priority': pri, 'category': cat}
+
+
+def is_processed(message_id):
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute('SELECT 1 FROM processed WHERE message_id = ?', (message_id,))
+    row = cur.fetchone()
+    return row is not None
+
+
+def has_migration(name):
+    cur = get_conn().cursor()
+    cur.execute('SELECT 1 FROM migrations WHERE name = ?', (name,))
+    return cur.fetchone() is not None
+
+
+def record_migration(name):
+    conn = get_conn()
+    with conn:
+        conn.execute('INSERT OR IGNORE INTO migrations (name, applied_at) VALUES (?, ?)',
+                     (name, datetime.datetime.utcnow().isoformat()))
+
+
+def iter_processed():
+    """Yield every recorded message id (used to rebuild the dedup filter)."""
+    cur = get_conn().cursor()
+    cur.execute('SELECT message_id FROM processed')
+    for row in cur:
+        yield row[0]
+
+
+def mark_processed_many(message_ids):
+    conn = get_conn()
+    with conn:
+        cur = conn.cursor()
+        cur.executemany('INSERT OR IGNORE INTO processed (message_id) VALUES (?)', [(m,) for m in message_ids])
+
+
+def clear_processed():
+    conn = get_conn()
+    with conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM processed')
+
+
+def acquire_lease(name, owner, ttl_seconds):
+    """
+    Take or renew the named lease for ttl_seconds. Returns True if owner holds it:
+    it was free, had expired, or already belonged to owner.
+    """
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        cur = conn.cursor()
+        cur.execute('''INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                       ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                       WHERE leases.owner = excluded.owner OR leases.expires_at < ?''',
+                    (name, owner, now + ttl_seconds, now))
+        acquired = cur.rowcount == 1
+    return acquired
@@ -0,0 +1,140 @@
+"""
+Duplicate detection for processed emails.
+A persistent Bloom filter answers "never seen" cheaply; the SQLite
+processed table confirms the rare positive hits exactly.
+"""
+import hashlib
+import mmap
+import os
+import threading
+import database
+
+BASE_DIR = os.path.dirname(__file__)
+BLOOM_PATH = os.path.join(BASE_DIR, 'data', 'processed.bloom')
+LEGACY_MIGRATION = 'processed_emails_txt'
+
+
+class BloomDedup:
+    """
+    Fixed-size Bloom filter backed by a memory-mapped file.
+    `rebuild` returns every key already recorded; it repopulates the bits
+    whenever the file has to be (re)created, so the filter never misses one.
+    """
+
+    def __init__(self, path: str, size_bits: int = 8 * 1024 * 1024, num_hashes: int = 7, rebuild=None):
+        self.path = path
+        self.size_bits = size_bits
+        self.num_hashes = num_hashes
+        self.rebuild = rebuild
+        self._file = None
+        self._map = None
+        self._lock = threading.RLock()
+
+    def _open(self) -> mmap.mmap:
+        """Map the bit array, creating it (and refilling it from `rebuild`) on first use."""
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    self._map = self._create_map()
+        return self._map
+
+    def _create_map(self) -> mmap.mmap:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        size_bytes = self.size_bits // 8
+        fresh = not os.path.exists(self.path) or os.path.getsize(self.path) != size_bytes
+        if fresh:
+            with open(self.path, 'wb') as f:
+                f.truncate(size_bytes)
+        self._file = open(self.path, 'r+b')
+        bits = mmap.mmap(self._file.fileno(), size_bytes)
+        if fresh and self.rebuild is not None:
+            for key in self.rebuild():
+                for pos in self._positions(key):
+                    bits[pos >> 3] |= 1 << (pos & 7)
+            bits.flush()
+        return bits
+
+    def _positions(self, key: str):
+        # One 128-bit digest split into two halves; the k bit positions are
+        # derived by double hashing (h1 + i*h2) instead of k separate hashes.
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.size_bits
+
+    def contains(self, key: str) -> bool:
+        """Return False if the key was definitely never added."""
+        bits = self._open()
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, key: str):
+        with self._lock:
+            bits = self._open()
+            for pos in self._positions(key):
+                bits[pos >> 3] |= 1 << (pos & 7)
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def clear(self):
+        """Reset every bit, forgetting all processed keys."""
+        with self._lock:
+            bits = self._open()
+            bits[:] = bytes(len(bits))
+            bits.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+
+
+# Singleton instance
+processed_filter = BloomDedup(BLOOM_PATH, rebuild=database.iter_processed)
+
+
+def is_processed(key: str) -> bool:
+    """Check whether an email (message id or raw line) was already turned into a ticket."""
+    if not processed_filter.contains(key):
+        return False
+    return database.is_processed(key)
+
+
+def mark_processed_many(keys):
+    """Record a whole batch with one SQLite commit and one flush of the filter."""
+    for key in keys:
+        processed_filter.add(key)
+    processed_filter.flush()
+    database.mark_processed_many(keys)
+
+
+def migrate_legacy_file(processed_file: str, emails_file: str):
+    """
+    One-time import of the old processed_emails.txt (SHA-256 hex per line).
+    Hashes can't be reversed, so lines of emails.txt are re-hashed and the
+    matching raw lines are recorded. O365 messages need no migration since
+    they were already marked as read in the mailbox. Completion is recorded
+    in the database; the file itself is left in place.
+    """
+    if database.has_migration(LEGACY_MIGRATION) or not os.path.exists(processed_file):
+        return
+    legacy = set(line.strip() for line in open(processed_file, encoding='utf-8') if line.strip())
+    if legacy and os.path.exists(emails_file):
+        lines = (raw.strip() for raw in open(emails_file, encoding='utf-8'))
+        mark_processed_many([raw for raw in lines
+                             if raw and hashlib.sha256(raw.encode('utf-8')).hexdigest() in legacy])
+    database.record_migration(LEGACY_MIGRATION)
+
+
+def reset_processed():
+    """Forget all processed emails so they will be ingested again."""
+    processed_filter.clear()
+    database.clear_processed()
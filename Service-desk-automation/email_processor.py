@@ -1,5 +1,6 @@
 """Rule-based email classification for Service Desk MVP."""
 from typing import Tuple
+import config
 
 KEYWORD_MAP = [
     (['password', 'reset', 'unlock'], ('Access Issue', 'Low')),
@@ -9,13 +10,16 @@ KEYWORD_MAP = [
     (['install', 'software', 'upgrade'], ('Software', 'Low')),
 ]
 
+# (keywords, (category id, priority)) per rule, so a match needs no name lookups
+_RULES = tuple((tuple(keywords), (config.CATEGORY_IDX[cat], prio)) for keywords, (cat, prio) in KEYWORD_MAP)
+
 
 def parse_email_line(line: str) -> dict:
     """
     Expected line format: sender|subject|body
-    Simple fallbacks are used if parts are missing.
+    Simple fallbacks are used if parts are missing; any further '|' stays in the body.
     """
-    parts = line.split('|')
+    parts = line.split('|', 2)
     sender = parts[0].strip() if len(parts) > 0 else 'unknown'
     subject = parts[1].strip() if len(parts) > 1 else ''
     body = parts[2].strip() if len(parts) > 2 else ''
@@ -23,10 +27,20 @@ def parse_email_line(line: str) -> dict:
 
 
 def classify_issue(text: str) -> Tuple[str, str]:
-    """Return (category, priority) based on simple keyword rules."""
+    """
+    Return (category, priority) based on simple keyword rules.
+    Matching is case-insensitive; callers pass the text as-is.
+    """
+    category_id, priority = classify_issue_id(text)
+    return config.CATEGORIES[category_id], priority
+
+
+def classify_issue_id(text: str) -> Tuple[int, str]:
+    """Like classify_issue, but returns the category as an index into config.CATEGORIES."""
     t = text.lower()
-    for keywords, (cat, prio) in KEYWORD_MAP:
+    # Substring tests run in C; the first matching rule wins
+    for keywords, result in _RULES:
         for k in keywords:
             if k in t:
-                return cat, prio
-    return 'General', 'Medium'
+                return result
+    return config.GENERAL_CATEGORY_ID, 'Medium'
@@ -2,16 +2,34 @@
 Microsoft Graph API client for reading Office 365 emails.
 Requires Azure AD app registration with Mail.Read permission.
 """
+import json
+import logging
+import time
+from itertools import islice
 import requests
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Iterator, List, Dict, Optional
 import config
 
+log = logging.getLogger(__name__)
+
+try:
+    import orjson  # faster parsing of large message pages
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 
 class GraphClient:
     """Client for Microsoft Graph API to read O365 mailbox."""
     
     TOKEN_URL = 'https://login.microsoftonline.com/{tenant}/oauth2/v2.0/token'
     GRAPH_URL = 'https://graph.microsoft.com/v1.0'
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    MAX_ATTEMPTS = 10
+    MAX_BACKOFF_SECONDS = 64
+    BATCH_SIZE = 20  # Graph's limit of sub-requests per $batch call
     
     def __init__(self):
         self.client_id = config.GRAPH_CLIENT_ID
@@ -19,10 +37,25 @@ class GraphClient:
         self.tenant_id = config.GRAPH_TENANT_ID
         self.user_email = config.GRAPH_USER_EMAIL
         self._token = None
+        self._token_expires_at = 0
+        self._session = self._build_session()
     
+    @staticmethod
+    def _build_session() -> requests.Session:
+        """
+        Session with a connection pool sized for parallel workers, so TLS
+        connections to Graph are kept alive and reused. Dropped connections
+        are retried here; HTTP-level throttling is handled by _request.
+        """
+        session = requests.Session()
+        retry = Retry(total=3, connect=3, read=0, status=0, backoff_factor=1, allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=retry)
+        session.mount('https://', adapter)
+        return session
+
     def _get_token(self) -> str:
-        """Get OAuth2 access token using client credentials flow."""
-        if self._token:
+        """Get OAuth2 access token using client credentials flow (cached until expiry)."""
+        if self._token and time.time() < self._token_expires_at:
             return self._token
         
         url = self.TOKEN_URL.format(tenant=self.tenant_id)
@@ -33,9 +66,12 @@ class GraphClient:
             'grant_type': 'client_credentials'
         }
         
-        resp = requests.post(url, data=data, timeout=30)
+        resp = self._session.post(url, data=data, timeout=30)
         resp.raise_for_status()
-        self._token = resp.json()['access_token']
+        payload = resp.json()
+        self._token = payload['access_token']
+        # Refresh a minute early so a token never expires mid-request
+        self._token_expires_at = time.time() + int(payload.get('expires_in', 3600)) - 60
         return self._token
     
     def _headers(self) -> dict:
@@ -44,47 +80,107 @@ class GraphClient:
             'Content-Type': 'application/json'
         }
     
-    def get_unread_emails(self, folder: str = 'Inbox', top: int = 50) -> List[Dict]:
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a Graph request, retrying throttling (429) and transient 5xx errors
+        with exponential backoff (1s doubling up to 64s), honouring Retry-After.
+        Returns the last response; callers decide how to handle errors.
+        """
+        for attempt in range(self.MAX_ATTEMPTS):
+            resp = self._session.request(method, url, headers=self._headers(), timeout=30, **kwargs)
+            if resp.status_code == 401 and attempt == 0:
+                # Token revoked or expired early: fetch a new one and retry
+                self._token = None
+                continue
+            if resp.status_code not in self.RETRY_STATUSES or attempt == self.MAX_ATTEMPTS - 1:
+                return resp
+            time.sleep(self._retry_delay(resp, attempt))
+        return resp
+
+    def _retry_delay(self, resp: requests.Response, attempt: int) -> float:
+        retry_after = resp.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(int(retry_after), self.MAX_BACKOFF_SECONDS)
+        return min(2 ** attempt, self.MAX_BACKOFF_SECONDS)
+
+    def iter_unread_emails(self, folder: str = 'Inbox', page_size: int = 50) -> Iterator[Dict]:
         """
-        Fetch unread emails from the specified folder.
-        Returns list of dicts with: id, sender, subject, body, received_at
+        Yield unread emails from the specified folder, newest first, following
+        @odata.nextLink so only one page is held in memory at a time.
+        Only bodyPreview (plain text, ~255 chars) is requested, which is enough
+        for classification and far smaller than full HTML bodies.
+        Yields dicts with: id, sender, subject, body, received_at
         """
         url = f"{self.GRAPH_URL}/users/{self.user_email}/mailFolders/{folder}/messages"
         params = {
             '$filter': 'isRead eq false',
-            '$top': top,
-            '$select': 'id,from,subject,body,receivedDateTime',
+            '$top': page_size,
+            '$select': 'id,from,subject,bodyPreview,receivedDateTime',
             '$orderby': 'receivedDateTime desc'
         }
         
-        resp = requests.get(url, headers=self._headers(), params=params, timeout=30)
-        resp.raise_for_status()
-        
-        emails = []
-        for msg in resp.json().get('value', []):
-            emails.append({
-                'id': msg['id'],
-                'sender': msg.get('from', {}).get('emailAddress', {}).get('address', 'unknown'),
-                'subject': msg.get('subject', ''),
-                'body': msg.get('body', {}).get('content', ''),
-                'received_at': msg.get('receivedDateTime', '')
-            })
-        return emails
+        while url:
+            resp = self._request('GET', url, params=params)
+            resp.raise_for_status()
+            params = None  # nextLink already carries the query
+            data = _json_loads(resp.content)
+            for msg in data.get('value', []):
+                yield self._normalize(msg)
+            url = data.get('@odata.nextLink')
+    
+    def get_unread_emails(self, folder: str = 'Inbox', top: int = 50) -> List[Dict]:
+        """Fetch up to `top` unread emails from the specified folder as a list."""
+        return list(islice(self.iter_unread_emails(folder, page_size=top), top))
+    
+    @staticmethod
+    def _normalize(msg: dict) -> Dict:
+        return {
+            'id': msg['id'],
+            'sender': msg.get('from', {}).get('emailAddress', {}).get('address', 'unknown'),
+            'subject': msg.get('subject', ''),
+            'body': msg.get('bodyPreview', ''),
+            'received_at': msg.get('receivedDateTime', '')
+        }
     
     def mark_as_read(self, message_id: str) -> bool:
         """Mark a message as read after processing."""
         url = f"{self.GRAPH_URL}/users/{self.user_email}/messages/{message_id}"
         data = {'isRead': True}
         
-        resp = requests.patch(url, headers=self._headers(), json=data, timeout=30)
+        resp = self._request('PATCH', url, json=data)
         return resp.status_code == 200
     
+    def mark_many_as_read(self, message_ids: List[str]) -> int:
+        """
+        Mark several messages as read using JSON batching ($batch),
+        20 PATCH sub-requests per HTTP call. Returns how many succeeded.
+        """
+        marked = 0
+        for start in range(0, len(message_ids), self.BATCH_SIZE):
+            chunk = message_ids[start:start + self.BATCH_SIZE]
+            body = {'requests': [
+                {
+                    'id': str(i),
+                    'method': 'PATCH',
+                    'url': f"/users/{self.user_email}/messages/{message_id}",
+                    'body': {'isRead': True},
+                    'headers': {'Content-Type': 'application/json'}
+                }
+                for i, message_id in enumerate(chunk)
+            ]}
+            resp = self._request('POST', f"{self.GRAPH_URL}/$batch", json=body)
+            if resp.status_code != 200:
+                log.error("$batch failed with status %s", resp.status_code)
+                continue
+            marked += sum(1 for r in _json_loads(resp.content).get('responses', []) if r.get('status') == 200)
+        return marked
+    
     def move_to_folder(self, message_id: str, destination_folder: str) -> bool:
         """Move processed email to a folder (e.g., 'Processed')."""
         url = f"{self.GRAPH_URL}/users/{self.user_email}/messages/{message_id}/move"
         data = {'destinationId': destination_folder}
         
-        resp = requests.post(url, headers=self._headers(), json=data, timeout=30)
+        resp = self._request('POST', url, json=data)
         return resp.status_code == 201
     
     def is_configured(self) -> bool:
@@ -96,17 +192,16 @@ class GraphClient:
 graph_client = GraphClient()
 
 
-def fetch_o365_emails() -> List[Dict]:
+def fetch_o365_emails() -> Iterator[Dict]:
     """
-    Fetch emails from O365 if configured, otherwise return empty list.
-    This is the main entry point for the automation.
+    Stream unread emails from O365 if configured, otherwise yield nothing.
+    This is the main entry point for the automation. Errors end the stream
+    early; emails already yielded are still processed.
     """
     if not graph_client.is_configured():
-        return []
+        return
     
     try:
-        emails = graph_client.get_unread_emails()
-        return emails
+        yield from graph_client.iter_unread_emails()
     except Exception as e:
-        print(f"[Graph API Error] {e}")
-        return []
+        log.error("Fetching emails failed: %s", e)
@@ -0,0 +1,89 @@
+"""
+Lightweight background job queue.
+Runs slow work (email ingestion, notifications) on a thread pool so
+HTTP requests can return immediately with a job id.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import logging
+import threading
+import uuid
+import config
+
+log = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Submit callables to worker threads and track their results."""
+
+    MAX_TRACKED_JOBS = 200
+
+    def __init__(self, max_workers: int = 4, eager: bool = False):
+        self.eager = eager
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs) -> str:
+        """Queue func(*args, **kwargs) and return its job id."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {'id': job_id, 'name': func.__name__, 'status': 'queued', 'result': None, 'error': None}
+            self._evict_finished()
+
+        if self.eager:
+            self._run(job_id, func, args, kwargs)
+        else:
+            self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def spawn(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the background without tracking it (fire and forget)."""
+        if self.eager:
+            self._run_untracked(func, args, kwargs)
+        else:
+            self._executor.submit(self._run_untracked, func, args, kwargs)
+
+    def _evict_finished(self):
+        # Oldest finished/failed records go first; queued or running jobs are
+        # never dropped, so their status stays available until they end
+        excess = len(self._jobs) - self.MAX_TRACKED_JOBS
+        if excess <= 0:
+            return
+        done = [job_id for job_id, job in self._jobs.items() if job['status'] in ('finished', 'failed')]
+        for job_id in done[:excess]:
+            del self._jobs[job_id]
+
+    def _run_untracked(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            log.error("Job %s failed: %s", func.__name__, e)
+
+    def _run(self, job_id, func, args, kwargs):
+        self._update(job_id, status='running')
+        try:
+            result = func(*args, **kwargs)
+            self._update(job_id, status='finished', result=result)
+        except Exception as e:
+            log.error("Job %s failed: %s", func.__name__, e)
+            self._update(job_id, status='failed', error=str(e))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(fields)
+
+    def get(self, job_id: str) -> dict:
+        """Return a copy of the job record, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# Singleton instance
+job_queue = JobQueue(max_workers=config.JOB_WORKERS, eager=config.JOBS_EAGER)
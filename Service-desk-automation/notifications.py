@@ -2,12 +2,165 @@
 Email notification service for sending ticket updates.
 Supports SMTP (O365, Gmail, etc.) for sending confirmations and alerts.
 """
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import logging
+import queue
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import Optional
+import time
+from email.message import EmailMessage
+import email.policy
+from typing import Optional, Union
+from jinja2 import DictLoader, Environment
 import config
 
+log = logging.getLogger(__name__)
+
+
+# Every email shares the same static skeleton; it is encoded once here and
+# the templates below render only the part inside <body>.
+HTML_PREFIX_BYTES = b'<html>\n<body style="font-family: Arial, sans-serif;">\n'
+HTML_SUFFIX_BYTES = b'</body>\n</html>\n'
+
+# Email body fragments, compiled once at import. Autoescaping keeps ticket text
+# (subjects come straight from inbound email) from injecting HTML.
+EMAIL_TEMPLATES = {
+    'ticket_created.html': """
+            <h2>Your Service Desk Ticket Has Been Created</h2>
+            <table style="border-collapse: collapse;">
+                <tr><td><strong>Ticket ID:</strong></td><td>#{{ ticket.id }}</td></tr>
+                <tr><td><strong>Issue:</strong></td><td>{{ ticket.issue }}</td></tr>
+                <tr><td><strong>Category:</strong></td><td>{{ ticket.category }}</td></tr>
+                <tr><td><strong>Priority:</strong></td><td>{{ ticket.priority }}</td></tr>
+                <tr><td><strong>Status:</strong></td><td>{{ ticket.status }}</td></tr>
+            </table>
+            <p>We will respond within the SLA timeframe for {{ ticket.priority }} priority tickets.</p>
+            <p>Thank you,<br>IT Service Desk</p>
+        """,
+    'ticket_resolved.html': """
+            <h2>Your Ticket Has Been Resolved</h2>
+            <p>Ticket <strong>#{{ ticket.id }}</strong> regarding "<em>{{ ticket.issue }}</em>" 
+            has been automatically resolved.</p>
+            <p>If you still need assistance, please reply to this email or submit a new request.</p>
+            <p>Thank you,<br>IT Service Desk</p>
+        """,
+    'ticket_escalated.html': """
+            <h2 style="color: #d32f2f;">High Priority Ticket Escalated</h2>
+            <table style="border-collapse: collapse;">
+                <tr><td><strong>Ticket ID:</strong></td><td>#{{ ticket.id }}</td></tr>
+                <tr><td><strong>From:</strong></td><td>{{ ticket.sender }}</td></tr>
+                <tr><td><strong>Issue:</strong></td><td>{{ ticket.issue }}</td></tr>
+                <tr><td><strong>Category:</strong></td><td>{{ ticket.category }}</td></tr>
+            </table>
+            <p><strong>Action Required:</strong> Please respond within SLA.</p>
+        """,
+    'sla_warning.html': """
+            <h2 style="color: #ff9800;">SLA Breach Warning</h2>
+            <p>Ticket <strong>#{{ ticket.id }}</strong> is approaching SLA breach.</p>
+            <p>Please take immediate action.</p>
+        """,
+    'sla_digest.html': """
+            <h2 style="color: #ff9800;">SLA Breach Warning</h2>
+            <p>The following tickets are approaching SLA breach:</p>
+            <table style="border-collapse: collapse;">
+                <tr><th>Ticket ID</th><th>Issue</th><th>Priority</th><th>From</th></tr>
+                {% for ticket in tickets %}
+                <tr><td>#{{ ticket.id }}</td><td>{{ ticket.issue }}</td><td>{{ ticket.priority }}</td><td>{{ ticket.sender }}</td></tr>
+                {% endfor %}
+            </table>
+            <p>Please take immediate action.</p>
+        """,
+}
+
+_env = Environment(loader=DictLoader(EMAIL_TEMPLATES), autoescape=True, auto_reload=False)
+TPL_CREATED = _env.get_template('ticket_created.html')
+TPL_RESOLVED = _env.get_template('ticket_resolved.html')
+TPL_ESCALATED = _env.get_template('ticket_escalated.html')
+TPL_SLA_WARN = _env.get_template('sla_warning.html')
+TPL_SLA_DIGEST = _env.get_template('sla_digest.html')
+
+
+def render_html(template, **context) -> bytes:
+    """Render a body fragment and wrap it in the pre-encoded HTML skeleton."""
+    return HTML_PREFIX_BYTES + template.render(**context).encode('utf-8') + HTML_SUFFIX_BYTES
+
+
+class SMTPPool:
+    """
+    Bounded pool of authenticated SMTP connections.
+    SMTP is stateful, so each connection serves one sender at a time; the pool
+    lets up to `size` threads send concurrently without repeating TLS + AUTH.
+    Connections are opened lazily and recycled after MAX_MESSAGES_PER_CONN sends.
+    """
+    
+    MAX_MESSAGES_PER_CONN = 100
+    IDLE_CHECK_SECONDS = 60  # NOOP-check connections idle longer than this
+    DISCONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionResetError)
+    
+    def __init__(self, connect, size: int = 3):
+        self._connect = connect
+        self._slots = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._slots.put(None)  # empty slot, connected on first use
+    
+    def send(self, msg):
+        slot = self._slots.get()
+        try:
+            slot = self._checked(slot)
+            try:
+                slot['smtp'].send_message(msg)
+            except self.DISCONNECT_ERRORS:
+                # Server dropped the kept-alive connection: reconnect once and retry
+                self._discard(slot)
+                slot = self._open()
+                slot['smtp'].send_message(msg)
+            slot['sent'] += 1
+            slot['last_used'] = time.monotonic()
+            if slot['sent'] >= self.MAX_MESSAGES_PER_CONN:
+                self._discard(slot, quit=True)
+                slot = None
+        except Exception:
+            self._discard(slot)
+            slot = None
+            raise
+        finally:
+            self._slots.put(slot)
+    
+    def _open(self) -> dict:
+        return {'smtp': self._connect(), 'sent': 0, 'last_used': time.monotonic()}
+    
+    def _checked(self, slot) -> dict:
+        """Return a usable connection for the slot, reconnecting if needed."""
+        if slot is not None and time.monotonic() - slot['last_used'] > self.IDLE_CHECK_SECONDS:
+            try:
+                if slot['smtp'].noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected()
+            except (smtplib.SMTPException, OSError):
+                self._discard(slot)
+                slot = None
+        return slot if slot is not None else self._open()
+    
+    @staticmethod
+    def _discard(slot, quit: bool = False):
+        if slot is None:
+            return
+        try:
+            slot['smtp'].quit() if quit else slot['smtp'].close()
+        except (smtplib.SMTPException, OSError):
+            pass
+    
+    def close(self):
+        """Close every idle connection in the pool."""
+        slots = []
+        while True:
+            try:
+                slots.append(self._slots.get_nowait())
+            except queue.Empty:
+                break
+        for slot in slots:
+            self._discard(slot, quit=True)
+            self._slots.put(None)
+
 
 class NotificationService:
     """Send email notifications for ticket events."""
@@ -18,106 +171,112 @@ class NotificationService:
         self.username = config.SMTP_USERNAME
         self.password = config.SMTP_PASSWORD
         self.from_addr = config.NOTIFICATION_FROM
+        # Parsed once; EmailMessage stores a ready header object without re-parsing
+        self._from_header = email.policy.default.header_factory('From', self.from_addr)
+        # Settings come from config at startup and never change at runtime
+        self._configured = bool(self.server and self.username and self.password)
+        self._pool = SMTPPool(self._connect, size=config.SMTP_POOL_SIZE)
+        # One sender thread per pooled connection for fan-out sends
+        self._senders = ThreadPoolExecutor(max_workers=config.SMTP_POOL_SIZE, thread_name_prefix='smtp')
+        atexit.register(self.close)
     
     def is_configured(self) -> bool:
-        return all([self.server, self.username, self.password])
+        return self._configured
     
-    def send_email(self, to: str, subject: str, body_html: str, body_text: Optional[str] = None) -> bool:
-        """Send an email notification."""
-        if not self.is_configured():
-            print("[Notification] SMTP not configured, skipping email")
+    def send_email(self, to: str, subject: str, body_html: Union[str, bytes], body_text: Optional[str] = None) -> bool:
+        """Send an email notification. body_html may be text or UTF-8 bytes."""
+        if not self._configured:
+            log.info("SMTP not configured, skipping email")
             return False
         
         try:
-            msg = MIMEMultipart('alternative')
+            msg = EmailMessage()
             msg['Subject'] = subject
-            msg['From'] = self.from_addr
+            msg['From'] = self._from_header
             msg['To'] = to
             
+            # HTML-only mail is a single text/html part; multipart/alternative
+            # is only built when there is a plain-text version too
             if body_text:
-                msg.attach(MIMEText(body_text, 'plain'))
-            msg.attach(MIMEText(body_html, 'html'))
+                msg.set_content(body_text)
+                self._set_html(msg.add_alternative, body_html)
+            else:
+                self._set_html(msg.set_content, body_html)
             
-            with smtplib.SMTP(self.server, self.port) as smtp:
-                smtp.starttls()
-                smtp.login(self.username, self.password)
-                smtp.send_message(msg)
+            self._pool.send(msg)
             
-            print(f"[Notification] Email sent to {to}")
+            log.debug("Email sent to %s", to)
             return True
         except Exception as e:
-            print(f"[Notification Error] {e}")
+            log.error("Sending email to %s failed: %s", to, e)
             return False
     
+    @staticmethod
+    def _set_html(setter, body_html: Union[str, bytes]):
+        if isinstance(body_html, bytes):
+            # Already UTF-8: base64 it directly instead of decoding and re-encoding
+            setter(body_html, maintype='text', subtype='html', cte='base64', params={'charset': 'utf-8'})
+        else:
+            setter(body_html, subtype='html')
+    
+    def send_many(self, emails: list) -> list:
+        """
+        Send (to, subject, body_html) emails concurrently, one per pooled
+        SMTP connection at a time. Returns a success flag per email, in order.
+        """
+        futures = [self._senders.submit(self.send_email, *email) for email in emails]
+        return [f.result() for f in futures]
+    
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.server, self.port, timeout=30)
+        smtp.ehlo()
+        smtp.starttls()
+        smtp.ehlo()
+        smtp.login(self.username, self.password)
+        return smtp
+    
+    def close(self):
+        """Politely end all kept-alive SMTP sessions."""
+        self._senders.shutdown(wait=True)
+        self._pool.close()
+    
     def send_ticket_created(self, ticket: dict) -> bool:
         """Send confirmation when a ticket is created."""
         subject = f"Ticket #{ticket['id']} Created: {ticket['issue']}"
-        body_html = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif;">
-            <h2>Your Service Desk Ticket Has Been Created</h2>
-            <table style="border-collapse: collapse;">
-                <tr><td><strong>Ticket ID:</strong></td><td>#{ticket['id']}</td></tr>
-                <tr><td><strong>Issue:</strong></td><td>{ticket['issue']}</td></tr>
-                <tr><td><strong>Category:</strong></td><td>{ticket['category']}</td></tr>
-                <tr><td><strong>Priority:</strong></td><td>{ticket['priority']}</td></tr>
-                <tr><td><strong>Status:</strong></td><td>{ticket['status']}</td></tr>
-            </table>
-            <p>We will respond within the SLA timeframe for {ticket['priority']} priority tickets.</p>
-            <p>Thank you,<br>IT Service Desk</p>
-        </body>
-        </html>
-        """
-        return self.send_email(ticket['sender'], subject, body_html)
+        return self.send_email(ticket['sender'], subject, render_html(TPL_CREATED, ticket=ticket))
     
     def send_ticket_resolved(self, ticket: dict) -> bool:
         """Send notification when a ticket is auto-resolved."""
         subject = f"Ticket #{ticket['id']} Resolved"
-        body_html = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif;">
-            <h2>Your Ticket Has Been Resolved</h2>
-            <p>Ticket <strong>#{ticket['id']}</strong> regarding "<em>{ticket['issue']}</em>" 
-            has been automatically resolved.</p>
-            <p>If you still need assistance, please reply to this email or submit a new request.</p>
-            <p>Thank you,<br>IT Service Desk</p>
-        </body>
-        </html>
-        """
-        return self.send_email(ticket['sender'], subject, body_html)
+        return self.send_email(ticket['sender'], subject, render_html(TPL_RESOLVED, ticket=ticket))
     
     def send_ticket_escalated(self, ticket: dict, team_email: str) -> bool:
         """Notify the assigned team about an escalated ticket."""
         subject = f"[ESCALATED] Ticket #{ticket['id']}: {ticket['issue']}"
-        body_html = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif;">
-            <h2 style="color: #d32f2f;">High Priority Ticket Escalated</h2>
-            <table style="border-collapse: collapse;">
-                <tr><td><strong>Ticket ID:</strong></td><td>#{ticket['id']}</td></tr>
-                <tr><td><strong>From:</strong></td><td>{ticket['sender']}</td></tr>
-                <tr><td><strong>Issue:</strong></td><td>{ticket['issue']}</td></tr>
-                <tr><td><strong>Category:</strong></td><td>{ticket['category']}</td></tr>
-            </table>
-            <p><strong>Action Required:</strong> Please respond within SLA.</p>
-        </body>
-        </html>
-        """
-        return self.send_email(team_email, subject, body_html)
+        return self.send_email(team_email, subject, render_html(TPL_ESCALATED, ticket=ticket))
     
     def send_sla_breach_warning(self, ticket: dict, team_email: str) -> bool:
         """Warn team about impending SLA breach."""
         subject = f"[SLA WARNING] Ticket #{ticket['id']} approaching breach"
-        body_html = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif;">
-            <h2 style="color: #ff9800;">SLA Breach Warning</h2>
-            <p>Ticket <strong>#{ticket['id']}</strong> is approaching SLA breach.</p>
-            <p>Please take immediate action.</p>
-        </body>
-        </html>
-        """
-        return self.send_email(team_email, subject, body_html)
+        return self.send_email(team_email, subject, render_html(TPL_SLA_WARN, ticket=ticket))
+    
+    def send_sla_digest(self, team_email: str, tickets: list) -> bool:
+        """Warn a team about all of its tickets approaching SLA breach in one email."""
+        return self.send_email(*self._sla_digest_email(team_email, tickets))
+    
+    def send_sla_digests(self, tickets_by_team: dict) -> list:
+        """Send every team its SLA digest in parallel."""
+        return self.send_many([self._sla_digest_email(team_email, tickets)
+                               for team_email, tickets in tickets_by_team.items()])
+    
+    @staticmethod
+    def _sla_digest_email(team_email: str, tickets: list) -> tuple:
+        if len(tickets) == 1:
+            ticket = tickets[0]
+            subject = f"[SLA WARNING] Ticket #{ticket['id']} approaching breach"
+            return team_email, subject, render_html(TPL_SLA_WARN, ticket=ticket)
+        subject = f"[SLA WARNING] {len(tickets)} tickets approaching breach"
+        return team_email, subject, render_html(TPL_SLA_DIGEST, tickets=tickets)
 
 
 # Singleton instance
@@ -2,18 +2,42 @@
 Background scheduler for automatic email processing.
 Uses APScheduler for periodic tasks.
 """
+from datetime import datetime, timedelta, timezone
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 import atexit
+import logging
+import os
+import socket
 import config
+import database
+
+log = logging.getLogger(__name__)
 
 
 class AutomationScheduler:
     """Manages background jobs for email processing and SLA checks."""
     
+    # The SLA job runs on this interval so new or re-prioritized tickets are
+    # picked up; after each run it is pulled earlier to the next warning/breach
+    SLA_MAX_INTERVAL = timedelta(minutes=5)
+    SLA_WARNING_THRESHOLD = timedelta(minutes=30)
+    
     def __init__(self):
-        self.scheduler = BackgroundScheduler()
+        # A slow run never overlaps the next one, and missed runs collapse into one
+        self.scheduler = BackgroundScheduler(job_defaults={
+            'coalesce': True,
+            'max_instances': 1,
+            'misfire_grace_time': config.POLL_INTERVAL_SECONDS,
+        })
+        self._email_trigger = IntervalTrigger(seconds=config.POLL_INTERVAL_SECONDS)
+        self._sla_trigger = IntervalTrigger(seconds=self.SLA_MAX_INTERVAL.total_seconds())
         self._started = False
+        self._process_func = None
+        self._sla_check_func = None
+        # Under several web workers each one starts a scheduler; a DB lease
+        # makes sure only one of them actually runs each job
+        self._owner = f'{socket.gethostname()}:{os.getpid()}'
     
     def start(self, process_func, sla_check_func=None):
         """Start the scheduler with the given processing functions."""
@@ -22,33 +46,82 @@ class AutomationScheduler:
         
         if config.AUTO_PROCESS_ENABLED:
             # Job 1: Process incoming emails
+            self._process_func = process_func
             self.scheduler.add_job(
-                func=process_func,
-                trigger=IntervalTrigger(seconds=config.POLL_INTERVAL_SECONDS),
+                func=self._run_email_processing,
+                trigger=self._email_trigger,
                 id='email_processor',
                 name='Process incoming emails',
                 replace_existing=True
             )
-            print(f"[Scheduler] Email processing every {config.POLL_INTERVAL_SECONDS}s")
+            log.info("Email processing every %ss", config.POLL_INTERVAL_SECONDS)
             
             # Job 2: Check SLA breaches
             if sla_check_func:
+                self._sla_check_func = sla_check_func
                 self.scheduler.add_job(
-                    func=sla_check_func,
-                    trigger=IntervalTrigger(minutes=5),
+                    func=self._run_sla_check,
+                    trigger=self._sla_trigger,
                     id='sla_checker',
                     name='Check SLA breaches',
                     replace_existing=True
                 )
-                print("[Scheduler] SLA checking every 5 minutes")
+                log.info("SLA checking at the next due time (at most every 5 minutes)")
             
             self.scheduler.start()
             self._started = True
+            if sla_check_func:
+                self._pull_sla_check_forward()
             
             # Shut down scheduler when app exits
             atexit.register(self.shutdown)
         else:
-            print("[Scheduler] Auto-processing disabled (set AUTO_PROCESS=true to enable)")
+            log.info("Auto-processing disabled (set AUTO_PROCESS=true to enable)")
+    
+    def _holds_lease(self, job_id: str, ttl: timedelta) -> bool:
+        """Claim or renew this process's lease on a job; False if another worker holds it."""
+        if database.acquire_lease(job_id, self._owner, ttl.total_seconds()):
+            return True
+        log.debug("Skipping %s: running in another worker", job_id)
+        return False
+    
+    def _run_email_processing(self):
+        # The lease outlives a few missed polls before another worker takes over
+        if self._holds_lease('email_processor', timedelta(seconds=config.POLL_INTERVAL_SECONDS * 3)):
+            self._process_func()
+    
+    def _run_sla_check(self):
+        """Run the SLA check, then move the next run up to the next event if it's sooner."""
+        try:
+            if self._holds_lease('sla_checker', self.SLA_MAX_INTERVAL * 3):
+                self._sla_check_func()
+        finally:
+            self._pull_sla_check_forward()
+    
+    def _next_sla_event(self):
+        """Soonest upcoming warning or breach time, or None if nothing is pending."""
+        now = datetime.now(timezone.utc)
+        candidates = []
+        # Tickets already inside the warning window only have their breach left
+        next_warning = database.get_next_resolution_due((now + self.SLA_WARNING_THRESHOLD).replace(tzinfo=None).isoformat())
+        if next_warning:
+            candidates.append(self._parse_utc(next_warning) - self.SLA_WARNING_THRESHOLD)
+        next_breach = database.get_next_resolution_due(now.replace(tzinfo=None).isoformat())
+        if next_breach:
+            candidates.append(self._parse_utc(next_breach))
+        return min(candidates, default=None)
+    
+    @staticmethod
+    def _parse_utc(value: str) -> datetime:
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+    
+    def _pull_sla_check_forward(self):
+        # Only ever moves the interval job earlier; if this is skipped or a run
+        # is missed, the job still fires on its regular interval
+        job = self.scheduler.get_job('sla_checker')
+        next_event = self._next_sla_event()
+        if job and job.next_run_time and next_event and next_event < job.next_run_time:
+            job.modify(next_run_time=next_event)
     
     def shutdown(self):
         """Gracefully shut down the scheduler."""
@@ -61,7 +134,8 @@ class AutomationScheduler:
         if self._started:
             job = self.scheduler.get_job(job_id)
             if job:
-                job.modify(next_run_time=None)  # run now
+                # next_run_time=None would pause the job instead
+                job.modify(next_run_time=datetime.now(tz=self.scheduler.timezone))
     
     def get_jobs_status(self) -> list:
         """Get status of all scheduled jobs."""
@@ -0,0 +1,48 @@
+"""
+SLA due-time rules on epoch seconds (UTC).
+Shared by database (which stores resolution_due) and sla_tracker, so the
+stored column and computed SLA status always agree.
+"""
+from datetime import datetime
+from functools import lru_cache
+import calendar
+import config
+
+
+def to_epoch(dt: datetime) -> int:
+    """Unix seconds; naive datetimes are taken as UTC like the stored timestamps."""
+    if dt.tzinfo is None:
+        return calendar.timegm(dt.timetuple())
+    return int(dt.timestamp())
+
+
+def parse_iso(s: str) -> datetime:
+    """
+    Parse a stored ISO timestamp; raises ValueError if it isn't one.
+    fromisoformat is implemented in C, so only a trailing 'Z' (rejected
+    before Python 3.11) is rewritten instead of always copying the string.
+    """
+    if s.endswith('Z'):
+        s = s[:-1] + '+00:00'
+    return datetime.fromisoformat(s)
+
+
+@lru_cache(maxsize=4096)
+def iso_to_epoch(value: str):
+    """Epoch seconds for a stored ISO timestamp; None if missing or unparseable."""
+    try:
+        return to_epoch(parse_iso(value))
+    except (AttributeError, ValueError):
+        return None
+
+
+def epoch_to_iso(epoch: int) -> str:
+    return datetime.utcfromtimestamp(epoch).isoformat()
+
+
+def response_due_epoch(priority: str, created: int) -> int:
+    return created + config.SLA_RESPONSE_HOURS.get(priority, 24) * 3600
+
+
+def resolution_due_epoch(priority: str, created: int) -> int:
+    return created + config.SLA_RESOLUTION_HOURS.get(priority, 72) * 3600
@@ -2,139 +2,178 @@
 SLA (Service Level Agreement) tracking for tickets.
 Monitors response and resolution times, sends warnings on breach.
 """
+from collections import defaultdict
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import List, Dict
+import heapq
+import logging
+import threading
+import time
 import database
 import config
+from sla_rules import epoch_to_iso, iso_to_epoch, resolution_due_epoch, response_due_epoch, to_epoch
 from notifications import notifier
 
+log = logging.getLogger(__name__)
 
-def calculate_sla_due(priority: str, created_at: str) -> Dict[str, str]:
-    """Calculate SLA due times based on priority."""
-    try:
-        created = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-    except:
-        created = datetime.utcnow()
-    
-    response_hours = config.SLA_RESPONSE_HOURS.get(priority, 24)
-    resolution_hours = config.SLA_RESOLUTION_HOURS.get(priority, 72)
-    
-    return {
-        'response_due': (created + timedelta(hours=response_hours)).isoformat(),
-        'resolution_due': (created + timedelta(hours=resolution_hours)).isoformat()
-    }
 
+@lru_cache(maxsize=4096)
+def _calculate_sla_due_epoch(priority: str, created_at: str):
+    """(response_due, resolution_due) as epoch seconds; None if created_at can't be parsed."""
+    created = iso_to_epoch(created_at)
+    if created is None:
+        return None
+    return response_due_epoch(priority, created), resolution_due_epoch(priority, created)
 
-def check_sla_status(ticket: dict) -> Dict[str, any]:
+
+def check_sla_status(ticket: dict, now: datetime = None) -> Dict[str, any]:
     """
     Check SLA status for a ticket.
     Returns: {'response_ok': bool, 'resolution_ok': bool, 'time_to_breach': timedelta}
     """
-    now = datetime.utcnow()
+    now_epoch = to_epoch(now) if now else int(time.time())
     priority = ticket.get('priority', 'Medium')
-    created_at = ticket.get('created_at', now.isoformat())
+    created_at = ticket.get('created_at') or ''
     
-    sla = calculate_sla_due(priority, created_at)
-    
-    try:
-        response_due = datetime.fromisoformat(sla['response_due'].replace('Z', '+00:00'))
-        resolution_due = datetime.fromisoformat(sla['resolution_due'].replace('Z', '+00:00'))
-    except:
-        response_due = now + timedelta(hours=24)
-        resolution_due = now + timedelta(hours=72)
+    due = _calculate_sla_due_epoch(priority, created_at)
+    if due is not None:
+        response_due, resolution_due = due
+    else:
+        response_due = now_epoch + 24 * 3600
+        resolution_due = now_epoch + 72 * 3600
     
     status = ticket.get('status', 'Open')
     is_closed = status in ('Closed', 'Resolved')
     
-    response_ok = is_closed or now < response_due
-    resolution_ok = is_closed or now < resolution_due
+    response_ok = is_closed or now_epoch < response_due
+    resolution_ok = is_closed or now_epoch < resolution_due
     
-    time_to_breach = resolution_due - now if not is_closed else timedelta(days=999)
+    time_to_breach = timedelta(seconds=resolution_due - now_epoch) if not is_closed else timedelta(days=999)
     
     return {
         'response_ok': response_ok,
         'resolution_ok': resolution_ok,
-        'response_due': sla['response_due'],
-        'resolution_due': sla['resolution_due'],
+        'response_due': epoch_to_iso(response_due),
+        'resolution_due': epoch_to_iso(resolution_due),
         'time_to_breach': time_to_breach,
         'breached': not resolution_ok
     }
 
 
-def get_tickets_near_breach(threshold_minutes: int = 30) -> List[dict]:
-    """Find tickets that will breach SLA within the threshold."""
-    tickets = database.list_tickets()
-    at_risk = []
-    
+def compute_sla_bulk(tickets: List[dict]) -> List[dict]:
+    """Attach SLA status to each ticket as ticket['sla'], using one reference time."""
+    now = datetime.utcnow()
     for ticket in tickets:
-        if ticket['status'] in ('Closed', 'Resolved'):
-            continue
-        
-        sla_status = check_sla_status(ticket)
-        if sla_status['time_to_breach'] < timedelta(minutes=threshold_minutes):
-            ticket['sla_status'] = sla_status
-            at_risk.append(ticket)
-    
-    return at_risk
+        ticket['sla'] = check_sla_status(ticket, now)
+    return tickets
 
 
-def get_breached_tickets() -> List[dict]:
-    """Find tickets that have already breached SLA."""
-    tickets = database.list_tickets()
-    breached = []
-    
-    for ticket in tickets:
-        if ticket['status'] in ('Closed', 'Resolved'):
-            continue
-        
-        sla_status = check_sla_status(ticket)
-        if sla_status['breached']:
-            ticket['sla_status'] = sla_status
-            breached.append(ticket)
-    
-    return breached
+def _resolution_due(ticket: dict):
+    """The ticket's stored resolution_due as epoch seconds (None if it has none)."""
+    return iso_to_epoch(ticket.get('resolution_due'))
+
+
+class SLAWatchlist:
+    """
+    Min-heap of upcoming SLA events (warning, breach) ordered by when they fire.
+    Each check only pops events that are due, instead of re-scanning every
+    open ticket. The heap is built from the DB once, then kept current by
+    reading only tickets whose updated_at changed since the previous check.
+    """
+
+    WARN = 'warn'
+    BREACH = 'breach'
+    # Rows committed shortly before a sync may carry an older timestamp
+    SYNC_OVERLAP = timedelta(minutes=1)
+
+    def __init__(self, warning_threshold: timedelta = timedelta(minutes=30)):
+        self.warning_threshold = warning_threshold
+        self._warning_seconds = int(warning_threshold.total_seconds())
+        self._heap = []     # (fire_at, ticket_id, kind, resolution_due), epoch seconds
+        self._events = {}   # (ticket_id, kind) -> [resolution_due, fired]
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def _sync(self, now: datetime):
+        if self._synced_at is None:
+            rows = database.list_open_tickets()
+        else:
+            rows = database.list_tickets_updated_since((self._synced_at - self.SYNC_OVERLAP).isoformat())
+        self._synced_at = now
+
+        for ticket in rows:
+            tid = ticket['id']
+            if ticket['status'] in ('Closed', 'Resolved'):
+                self._events.pop((tid, self.WARN), None)
+                self._events.pop((tid, self.BREACH), None)
+                continue
+            due = _resolution_due(ticket)
+            if due is None:
+                continue
+            for kind, fire_at in ((self.WARN, due - self._warning_seconds), (self.BREACH, due)):
+                event = self._events.get((tid, kind))
+                if event is None or event[0] != due:
+                    self._events[(tid, kind)] = [due, False]
+                    heapq.heappush(self._heap, (fire_at, tid, kind, due))
+
+    def pop_due(self, now: datetime = None) -> Dict[str, List[dict]]:
+        """Return open tickets whose warning or breach time has been reached since the last call."""
+        now = now or datetime.utcnow()
+        now_epoch = to_epoch(now)
+        due_events = {self.WARN: [], self.BREACH: []}
+        with self._lock:
+            self._sync(now)
+            while self._heap and self._heap[0][0] <= now_epoch:
+                _, tid, kind, due = heapq.heappop(self._heap)
+                event = self._events.get((tid, kind))
+                if event is None or event[0] != due or event[1]:
+                    continue  # superseded by a priority change, closed, or already sent
+                ticket = database.get_ticket_by_id(tid)
+                if not ticket or ticket['status'] in ('Closed', 'Resolved') or _resolution_due(ticket) != due:
+                    continue  # changed after the last sync; the next sync re-queues it
+                event[1] = True
+                due_events[kind].append(ticket)
+        return due_events
+
+
+# Singleton instance
+sla_watchlist = SLAWatchlist()
 
 
 def run_sla_check():
     """
-    Scheduled job to check all open tickets for SLA status.
-    Sends notifications for at-risk and breached tickets.
+    Scheduled job to check open tickets for SLA status.
+    Sends one warning per ticket when it comes within 30 minutes of breach
+    and logs each ticket once when it breaches.
     """
-    print("[SLA Check] Running SLA compliance check...")
+    log.info("Running SLA compliance check...")
+    
+    events = sla_watchlist.pop_due()
     
-    # Check tickets near breach (within 30 minutes)
-    at_risk = get_tickets_near_breach(threshold_minutes=30)
+    # Tickets that just came within 30 minutes of breach: one digest per team,
+    # sent in parallel over the notifier's SMTP connection pool
+    at_risk = events[SLAWatchlist.WARN]
+    by_team = defaultdict(list)
     for ticket in at_risk:
-        team_email = config.TEAM_ASSIGNMENTS.get(ticket['category'], 'helpdesk@example.com')
-        notifier.send_sla_breach_warning(ticket, team_email)
-        print(f"[SLA Warning] Ticket #{ticket['id']} approaching breach")
+        by_team[config.TEAM_BY_IDX[ticket['category_id']]].append(ticket)
+        log.debug("Ticket #%s approaching breach", ticket['id'])
+    notifier.send_sla_digests(by_team)
     
-    # Check already breached
-    breached = get_breached_tickets()
+    # Tickets that just breached
+    breached = events[SLAWatchlist.BREACH]
     for ticket in breached:
-        print(f"[SLA BREACH] Ticket #{ticket['id']} has breached SLA!")
+        log.debug("Ticket #%s has breached SLA!", ticket['id'])
     
-    print(f"[SLA Check] Complete. At-risk: {len(at_risk)}, Breached: {len(breached)}")
+    log.info("SLA check complete. At-risk: %d, Breached: %d", len(at_risk), len(breached))
     return {'at_risk': len(at_risk), 'breached': len(breached)}
 
 
 def get_sla_summary() -> Dict:
     """Get overall SLA compliance metrics."""
-    tickets = database.list_tickets()
-    
-    total = len(tickets)
-    compliant = 0
-    breached = 0
-    at_risk = 0
-    
-    for ticket in tickets:
-        sla_status = check_sla_status(ticket)
-        if sla_status['breached']:
-            breached += 1
-        elif sla_status['time_to_breach'] < timedelta(hours=1):
-            at_risk += 1
-        else:
-            compliant += 1
+    now = datetime.utcnow()
+    total, breached, at_risk = database.count_sla_states(now.isoformat(), (now + timedelta(hours=1)).isoformat())
+    compliant = total - breached - at_risk
     
     compliance_rate = (compliant / total * 100) if total > 0 else 100
     